@@ -1,8 +1,10 @@
-from typing import cast, Iterable
+from typing import Iterable
 
 from dataclasses import dataclass
 import dataclasses
 
+import array
+
 import pypdf
 import argparse
 
@@ -16,6 +18,56 @@ class Args:
     mark_width: float
     mark_color: tuple[int, int, int]
 
+# A page of the booklet is either the page number of a page taken from the input PDF, or BLANK_PAGE for a blank page inserted into the booklet to pad the page count to a multiple of 4
+# Pages are plain ints (and lists of pages are int arrays) instead of objects because a booklet can have thousands of them
+BLANK_PAGE = -1
+
+@dataclass(slots=True)
+class Spread:
+    """A spread that contains 4 pages: two on the front and two on the back. Every spread, when turned into a booklet, should have a vertical fold in the middle of it.
+
+    If you imagine looking at a spread from the front, the page on the left side of the front is front_left and likewise with front_right. The backside is also defined based on the directions looking from the front side, so the back_left is the backside of front_left and back_right is the backside of front_right.
+
+    For another example, if you imagine a booklet with only 4 pages, it would only have one spread. Page 1 would be on the back_left, page 2 would be on the front_left, page 3 would be on the front_right, and page 4 would be on the back_right.
+
+    Each page is either a page number in the input PDF or BLANK_PAGE.
+    """
+    front_left: int
+    front_right: int
+    back_left: int
+    back_right: int
+
+@dataclass(slots=True)
+class OutputSheet:
+    """A sheet of paper that the output is printed on. It will contain many spreads on it."""
+    # paper_size and spread_size are measured in inches
+    paper_size: tuple[float, float]
+    spread_size: tuple[float, float]
+    spreads: list[Spread] = dataclasses.field(default_factory=lambda: [])
+
+    # These only depend on paper_size and spread_size, so they are computed once when the sheet is created instead of every time they are used
+    # The number of rows of spreads that can fit on this output sheet.
+    spread_grid_rows: int = dataclasses.field(init=False)
+    # The number of columns of spreads that can fit on this output sheet.
+    spread_grid_cols: int = dataclasses.field(init=False)
+    # The total number of spreads that can fit on this output sheet.
+    max_spreads: int = dataclasses.field(init=False)
+
+    def __post_init__(self) -> None:
+        self.spread_grid_rows = int(self.paper_size[1] // self.spread_size[1])
+        self.spread_grid_cols = int(self.paper_size[0] // self.spread_size[0])
+        self.max_spreads = self.spread_grid_rows * self.spread_grid_cols
+
+    def iter_spreads(self) -> Iterable[tuple[int, int, Spread]]:
+        """Iterate through all of the spreads on this page with the coordinates of where they are.
+
+        Note that the coordinates are for the spreads and not for the pages, so they always increment by 1.
+        """
+        cols = self.spread_grid_cols
+        for i, spread in enumerate(self.spreads):
+            y, x = divmod(i, cols)
+            yield (x, y, spread)
+
 def parse_args() -> Args:
     """Parse command-line arguments"""
 
@@ -23,7 +75,7 @@ def parse_args() -> Args:
 
     parser.add_argument('-i', '--input', required=True, help='Input file')
     parser.add_argument('-o', '--output', required=True, help='Output file')
-    parser.add_argument('-s', '--scale', required=True, help='The scale of the booklet\'s pages compared to the input pages, written as a fraction (e.g. \"1/4\")')
+    parser.add_argument('-s', '--scale', required=True, help='The scale of the booklet\'s pages compared to the input pages, written as a fraction (e.g. \"1/4\") or a decimal (e.g. \"0.25\")')
     parser.add_argument('-l', '--last', '--last-pages',
         type=int,
         default=0,
@@ -38,8 +90,13 @@ def parse_args() -> Args:
 
     args = parser.parse_args()
 
-    # TODO: do a proper error message for this instead of "ValueError: not enough values to unpack (expected 2, got 1)"
-    num, denom = args.scale.split("/", 1)
+    num, slash, denom = args.scale.partition("/")
+    try:
+        scale = float(num) / float(denom) if slash else float(num)
+    except (ValueError, ZeroDivisionError):
+        parser.error(f'invalid scale: {args.scale!r} (expected a fraction like "1/4" or a decimal like "0.25")')
+    if not scale > 0:
+        parser.error(f'invalid scale: {args.scale!r} (the scale must be positive)')
 
     mark_color_int = int(args.mark_color, 16)
     mark_color = (0xff & (mark_color_int >> 16), 0xff & (mark_color_int >> 8), 0xff & mark_color_int)
@@ -47,7 +104,7 @@ def parse_args() -> Args:
     return Args(
         input=args.input,
         output=args.output,
-        scale=int(num) / int(denom), # TODO: do a proper error message for this instead of "ValueError: invalid literal for int() with base 10"
+        scale=scale,
         last_pages=args.last_pages,
         mark_cut_lines=args.mark_cut_lines,
         mark_width=args.mark_width,
@@ -67,186 +124,259 @@ def impose(input: pypdf.PdfReader, output: pypdf.PdfWriter, scale: float, num_la
     - mark_width: The width of the lines enabled by the `mark_cut_lines` option. This is measured in inches
     """
 
-    # input_page_size, input_page_sizes, and spread_size are measured in inches
-
-    # Get the size of the pages in the input PDF, erroring if different pages have different sizes in the PDF
-    input_page_sizes = set(map(lambda page: (page.mediabox.width * page.user_unit / 72, page.mediabox.height * page.user_unit / 72), input.pages))
-    if len(input_page_sizes) != 1:
-        raise Exception('pdf has multiple different page sizes')
-    input_page_size: tuple[float, float] = input_page_sizes.pop()
+    # input_page_size and spread_size are measured in inches
+
+    def page_size(page: pypdf.PageObject) -> tuple[float, float]:
+        """Get the size of a page of the input PDF in inches"""
+        return (page.mediabox.width * page.user_unit / 72, page.mediabox.height * page.user_unit / 72)
+
+    # Resolve every input page once up front so that placing a page on a sheet doesn't have to walk pypdf's page tree again
+    # This also gets the size of the pages in the input PDF in the same pass, erroring as soon as a page has a different size from the first one
+    if input.get_num_pages() == 0:
+        raise Exception('pdf has no pages')
+    first_page = input.get_page(0)
+    input_page_size = page_size(first_page)
+    input_pages: list[pypdf.PageObject] = [first_page]
+    for n in range(1, input.get_num_pages()):
+        page = input.get_page(n)
+        if page_size(page) != input_page_size:
+            raise Exception('pdf has multiple different page sizes')
+        input_pages.append(page)
 
     spread_size = (input_page_size[0] * scale * 2, input_page_size[1] * scale)
 
-    @dataclass
-    class OriginalPage:
-        """A page taken from the input PDF"""
-        page_number: int
-    class BlankPage:
-        """A blank page inserted into the booklet to pad the page count to a multiple of 4"""
-        pass
-    Page = OriginalPage | BlankPage
-
-    @dataclass
-    class Spread:
-        """A spread that contains 4 pages: two on the front and two on the back. Every spread, when turned into a booklet, should have a vertical fold in the middle of it.
-
-        If you imagine looking at a spread from the front, the page on the left side of the front is front_left and likewise with front_right. The backside is also defined based on the directions looking from the front side, so the back_left is the backside of front_left and back_right is the backside of front_right.
-
-        For another example, if you imagine a booklet with only 4 pages, it would only have one spread. Page 1 would be on the back_left, page 2 would be on the front_left, page 3 would be on the front_right, and page 4 would be on the back_right.
-        """
-        front_left: Page
-        front_right: Page
-        back_left: Page
-        back_right: Page
-
-    @dataclass
-    class OutputSheet:
-        """A sheet of paper that the output is printed on. It will contain many spreads on it."""
-        # paper_size is also measured in inches
-        paper_size: tuple[float, float]
-        spreads: list[Spread] = dataclasses.field(default_factory=lambda: [])
-
-        @property
-        def spread_grid_rows(self) -> int:
-            """The number of rows of spreads that can fit on this output sheet."""
-            return int(self.paper_size[1] // spread_size[1])
-        @property
-        def spread_grid_cols(self) -> int:
-            """The number of columns of spreads that can fit on this output sheet."""
-            return int(self.paper_size[0] // spread_size[0])
-
-        @property
-        def max_spreads(self) -> int:
-            """The total number of spreads that can fit on this output sheet."""
-            return self.spread_grid_rows * self.spread_grid_cols
-
-        def is_full(self) -> bool:
-            """Return whether or not this output sheet is fully filled up."""
-            return len(self.spreads) >= self.max_spreads
-
-        def add_spread(self, spread: Spread) -> None:
-            """Add a new spread to this output sheet.
-
-            This will throw an exception if the sheet is full
-            """
-            if self.is_full():
-                raise Exception('cannot add spread to an output sheet that is already full')
-
-            self.spreads.append(spread)
-
-        def iter_spreads(self) -> Iterable[tuple[int, int, Spread]]:
-            """Iterate through all of the spreads on this page with the coordinates of where they are.
-
-            Note that the coordinates are for the spreads and not for the pages, so they always increment by 1.
-            """
-            x = 0
-            y = 0
-            for i, spread in enumerate(self.spreads):
-                yield (x, y, spread)
-                x += 1
-                if x >= self.spread_grid_cols:
-                    x = 0
-                    y += 1
-
-    def pad_pages(pages: list[OriginalPage]) -> list[Page]:
+    def pad_pages(pages: 'array.array[int]') -> 'array.array[int]':
         """Pad the list of pages to a multiple of 4, taking num_last_pages into account"""
         if len(pages) % 4 != 0:
             pages_to_add = 4 - len(pages) % 4
+            num_first_pages = len(pages) - num_last_pages
 
-            first_pages = pages[:len(pages) - num_last_pages]
-            last_pages = cast(list[Page], pages[len(pages) - num_last_pages:])
-            blank_pages = [BlankPage() for _ in range(pages_to_add)]
+            padded_pages = pages[:]
+            padded_pages[num_first_pages:num_first_pages] = array.array('i', [BLANK_PAGE]) * pages_to_add
 
-            return first_pages + blank_pages + last_pages
+            return padded_pages
         else:
-            return cast(list[Page], pages)
+            return pages
 
-    def make_spreads(pages: list[Page]) -> list[Spread]:
+    def make_spreads(pages: 'array.array[int]') -> list[Spread]:
         """Group a list of pages into spreads.
 
         The input list of pages should have a length that is a multiple of 4.
         """
 
-        # This works as a recursive algorithm.
+        # This works from the outside of the booklet inwards.
         # First, we take the first two pages and last two pages and make a spread out of that, with the first page going on the back_left, the second going on the front_left, the second to last going on the front_right, and the last going on the back_right.
-        # From there, we can imagine taking off those first two pages and last two pages and making a booklet out of the inner pages, which is where we can recurse on the inner pages.
+        # From there, we can imagine taking off those first two pages and last two pages and making a booklet out of the inner pages, which is done by moving the two indices inwards instead of slicing the list (and recursing), which would make this quadratic.
 
-        if len(pages) == 0:
-            return []
-        else:
-            spread = Spread(back_left=pages[0], front_left=pages[1], back_right=pages[-1], front_right=pages[-2])
-            pages_left = pages[2:-2]
-            return [spread] + make_spreads(pages_left)
+        spreads: list[Spread] = []
+        lo = 0
+        hi = len(pages) - 1
+        while lo < hi:
+            spreads.append(Spread(back_left=pages[lo], front_left=pages[lo + 1], back_right=pages[hi], front_right=pages[hi - 1]))
+            lo += 2
+            hi -= 2
+        return spreads
 
     def lay_out_spreads(spreads: list[Spread]) -> list[OutputSheet]:
         """Lay out spreads onto output sheets."""
 
-        sheets = [OutputSheet(input_page_size)]
-
-        for spread in spreads:
-            if sheets[-1].is_full():
-                sheets.append(OutputSheet(input_page_size))
-
-            sheets[-1].add_spread(spread)
+        # Every sheet has the same paper size, so they can all hold the same number of spreads and the spreads can just be split into chunks of that size
+        spreads_per_sheet = OutputSheet(input_page_size, spread_size).max_spreads
+        if spreads_per_sheet == 0:
+            raise Exception('spreads are too big to fit on an output sheet')
 
-        return sheets
+        return [OutputSheet(input_page_size, spread_size, spreads[start:start + spreads_per_sheet]) for start in range(0, len(spreads), spreads_per_sheet)]
 
     def write_sheets(sheets: list[OutputSheet]) -> None:
         """Write output sheets to the output pdf"""
 
-        def add_page(drawing_commands: list[str], output_page: pypdf.PageObject, input_page: Page, x: float, y: float) -> None:
+        def make_form_xobject(input_page: pypdf.PageObject) -> pypdf.generic.IndirectObject:
+            """Copy a page of the input pdf into the output pdf as a form XObject
+
+            This way, the page can be drawn onto an output page with a single `Do` command, instead of having its contents parsed, transformed, and merged into the output page along with all of its resources.
+            The XObject is clipped to the crop box of the page, which is the same clipping that merging the page would do.
+            """
+
+            contents = input_page.get_contents()
+            xobject = pypdf.generic.DecodedStreamObject()
+            xobject.set_data(contents.get_data() if contents is not None else b'')
+            xobject[pypdf.generic.NameObject('/Type')] = pypdf.generic.NameObject('/XObject')
+            xobject[pypdf.generic.NameObject('/Subtype')] = pypdf.generic.NameObject('/Form')
+            xobject[pypdf.generic.NameObject('/BBox')] = pypdf.generic.ArrayObject(input_page.cropbox)
+            if '/Resources' in input_page:
+                xobject[pypdf.generic.NameObject('/Resources')] = input_page['/Resources'].get_object().clone(output)
+            return output._add_object(xobject)
+
+        def add_annotations(output_page: pypdf.PageObject, input_page: pypdf.PageObject, x: float, y: float) -> None:
+            """Copy the annotations of an input page onto an output page, moving them to where the input page is drawn
+
+            The form XObject of a page only has its contents, so without this, things like stamps, comments, and filled in form fields would be lost.
+            This does the same thing that merging the page would do: every annotation is cloned, and its `/Rect` and `/QuadPoints` are mapped through the same matrix that the page is drawn with.
+            """
+
+            def transform_point(px: float, py: float) -> tuple[pypdf.generic.FloatObject, pypdf.generic.FloatObject]:
+                return (pypdf.generic.FloatObject(px * scale + x), pypdf.generic.FloatObject(py * scale + y))
+
+            if '/Annots' not in output_page:
+                output_page[pypdf.generic.NameObject('/Annots')] = pypdf.generic.ArrayObject()
+            output_annots = output_page['/Annots'].get_object()
+
+            for annot_ref in input_page['/Annots'].get_object():
+                annot = annot_ref.get_object()
+                new_annot = annot.clone(output, force_duplicate=True, ignore_fields=('/P', '/StructParent', '/Parent'))
+
+                rect = annot['/Rect']
+                left, bottom = transform_point(min(rect[0], rect[2]), min(rect[1], rect[3]))
+                right, top = transform_point(max(rect[0], rect[2]), max(rect[1], rect[3]))
+                new_annot[pypdf.generic.NameObject('/Rect')] = pypdf.generic.ArrayObject([left, bottom, right, top])
+                if '/QuadPoints' in annot:
+                    quad_points = annot['/QuadPoints']
+                    new_annot[pypdf.generic.NameObject('/QuadPoints')] = pypdf.generic.ArrayObject([coordinate for i in range(0, len(quad_points) - 1, 2) for coordinate in transform_point(quad_points[i], quad_points[i + 1])])
+
+                if '/Popup' in new_annot:
+                    new_annot['/Popup'].get_object()[pypdf.generic.NameObject('/Parent')] = new_annot.indirect_reference
+                new_annot[pypdf.generic.NameObject('/P')] = output_page.indirect_reference
+                output_annots.append(new_annot.indirect_reference)
+
+        def add_page(drawing_commands: bytearray, output_page: pypdf.PageObject, xobjects: pypdf.generic.DictionaryObject, input_page: int, x: float, y: float) -> None:
             """Write a page of the input pdf to an output page at a certain location
 
             Arguments:
-            - drawing_commands: Any drawing commands that are used to make the cut lines are added to this list
-            - output_page: The output page to put a page on
-            - input_page: THe input page to put onto the output page
-            - x, y: The coordinates of where the input_page should appear on the output page, measured in inches. Note that this follows the PDF coordinate space, so y=0 is at the bottom of the page
+            - drawing_commands: The command that draws the page is added to this buffer, which becomes the contents of the output page
+            - output_page: The output page to put the page on, which the annotations of the input page are copied onto
+            - xobjects: The XObject resources of the output page, which the XObject of the input page is added to
+            - input_page: The page number of the input page to put onto the output page, or BLANK_PAGE
+            - x, y: The coordinates of where the input_page should appear on the output page, measured in points. Note that this follows the PDF coordinate space, so y=0 is at the bottom of the page
             """
 
-            if mark_cut_lines:
-                left = x * 72
-                bottom = y * 72
-                drawing_commands.append(f'{left} {bottom} {input_page_size[0] * scale * 72} {input_page_size[1] * scale * 72} re s')
-
-            if isinstance(input_page, BlankPage):
+            if input_page == BLANK_PAGE:
                 pass
             else:
-                transform = pypdf.Transformation().scale(scale, scale).translate(x * 72, y * 72)
-                output_page.merge_transformed_page(input.get_page(input_page.page_number), transform)
+                # The matrix of the cm command is the same as Transformation().scale(scale, scale).translate(x, y), but written out directly
+                xobjects[pypdf.generic.NameObject(f'/P{input_page}')] = page_xobjects[input_page]
+                drawing_commands += b'q %s %.3f %.3f cm /P%d Do Q ' % (scale_matrix, x, y, input_page)
+                if '/Annots' in input_pages[input_page]:
+                    add_annotations(output_page, input_pages[input_page], x, y)
+
+        def merge_spans(spans: list[tuple[float, float]]) -> list[tuple[float, float]]:
+            """Join together any spans along a line that touch or overlap"""
+            merged: list[tuple[float, float]] = []
+            for start, end in sorted(spans):
+                # The coordinates are rounded to a thousandth of a point, so anything closer than that is considered to be touching
+                if len(merged) > 0 and start <= merged[-1][1] + 0.001:
+                    merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+                else:
+                    merged.append((start, end))
+            return merged
+
+        def cut_lines(page_positions: list[tuple[float, float]]) -> bytes:
+            """Make the drawing commands that stroke the cut lines around pages placed on an output page
+
+            All of the pages are the same size and are laid out in a grid, so neighboring pages share edges. Instead of stroking a rectangle around every page (which would stroke every shared edge twice), the edges are collected by the horizontal or vertical line that they lie on, and the edges that touch along a line are joined into one segment.
+
+            Arguments:
+            - page_positions: The coordinates of the bottom left corners of the pages, measured in points
+            """
+
+            # These map the y coordinate of a horizontal line (or the x coordinate of a vertical line) to the spans of that line that are edges of pages
+            # Everything is rounded so that edges that should line up but that were computed with slightly different floating point error still do
+            horizontal_lines: dict[float, list[tuple[float, float]]] = {}
+            vertical_lines: dict[float, list[tuple[float, float]]] = {}
+            for (x, y) in page_positions:
+                left, right = round(x, 3), round(x + page_width_pts, 3)
+                bottom, top = round(y, 3), round(y + page_height_pts, 3)
+                horizontal_lines.setdefault(bottom, []).append((left, right))
+                horizontal_lines.setdefault(top, []).append((left, right))
+                vertical_lines.setdefault(left, []).append((bottom, top))
+                vertical_lines.setdefault(right, []).append((bottom, top))
+
+            commands = bytearray()
+            for y, spans in horizontal_lines.items():
+                for (start, end) in merge_spans(spans):
+                    commands += b'%.3f %.3f m %.3f %.3f l ' % (start, y, end, y)
+            for x, spans in vertical_lines.items():
+                for (start, end) in merge_spans(spans):
+                    commands += b'%.3f %.3f m %.3f %.3f l ' % (x, start, x, end)
+            commands += b'S '
+            return bytes(commands)
+
+        def set_contents(output_page: pypdf.PageObject, drawing_commands: bytearray) -> None:
+            """Set the contents of an output page to the given drawing commands"""
+            stream = pypdf.generic.DecodedStreamObject()
+            stream.set_data(bytes(drawing_commands))
+            output_page[pypdf.generic.NameObject('/Contents')] = output._add_object(stream)
 
         # This is also measured in inches
         # Right now, we just take the page size of the input PDF, but in the future, this might take the size from a command-line argument
         output_sheet_width = input_page_size[0]
         output_sheet_height = input_page_size[1]
 
+        # The coordinates of each of the 4 pages of a spread only depend on which column or row of the grid the spread is in, so they are computed once for the whole grid here instead of for every spread.
+        # Every sheet has the same paper size and so the same grid, and the first sheet is the fullest one, so the tables only need to cover the part of the grid that the first sheet uses. (With a small enough scale, the whole grid could be enormous.) These are measured in points.
+        used_cols = min(sheets[0].spread_grid_cols, len(sheets[0].spreads))
+        used_rows = -(-len(sheets[0].spreads) // used_cols)
+        grid_cols = range(used_cols)
+        grid_rows = range(used_rows)
+        front_left_xs = [spread_size[0] * spread_x * 72 for spread_x in grid_cols]
+        front_right_xs = [spread_size[0] * (spread_x + 0.5) * 72 for spread_x in grid_cols]
+        back_left_xs = [(output_sheet_width - spread_size[0] * (spread_x + 1 - 0.5)) * 72 for spread_x in grid_cols]
+        back_right_xs = [(output_sheet_width - spread_size[0] * (spread_x + 1)) * 72 for spread_x in grid_cols]
+        ys = [spread_size[1] * spread_y * 72 for spread_y in grid_rows]
+        # The size of a page of the booklet, measured in points
+        # Coordinates are written into the content streams with 3 decimal places, because a thousandth of a point is far finer than any printer can resolve and Python's full float precision would only make the streams longer
+        page_width_pts = input_page_size[0] * scale * 72
+        page_height_pts = input_page_size[1] * scale * 72
+
+        # Every input page is copied into the output once, and then the output pages just refer to it
+        page_xobjects = [make_form_xobject(page) for page in input_pages]
+        # The scale part of the matrix that every page is drawn with
+        scale_str = ('%.9f' % scale).rstrip('0').rstrip('.').encode('ascii')
+        scale_matrix = b'%s 0 0 %s' % (scale_str, scale_str)
+
+        # These commands set the stroke color, the stroke width, and the line cap style of the drawing context before the cut lines are drawn
+        # They are the same for every side of every sheet: the output pages are all made by add_blank_page, so their user unit is always the default of 1 point, which means the width only needs to be converted from inches to points
+        # The cut lines are drawn as separate segments instead of closed rectangles, so the projecting square line cap is used to keep the corners where the segments meet filled in
+        cut_line_prelude = f'{mark_color[0] / 255:.3f} {mark_color[1] / 255:.3f} {mark_color[2] / 255:.3f} RG {mark_width * 72:.3f} w 2 J '.encode('ascii')
+
         for sheet in sheets:
             front_side = output.add_blank_page(output_sheet_width * 72, output_sheet_height * 72)
             back_side = output.add_blank_page(output_sheet_width * 72, output_sheet_height * 72)
 
-            # These first 2 commands set the stroke color and the stroke width of the drawing contex
-            front_drawing_commands: list[str] = [f'{mark_color[0] / 255} {mark_color[1] / 255} {mark_color[2] / 255} RG {mark_width * 72 / front_side.user_unit} w']
-            back_drawing_commands: list[str] = [f'{mark_color[0] / 255} {mark_color[1] / 255} {mark_color[2] / 255} RG {mark_width * 72 / back_side.user_unit} w']
+            front_xobjects = pypdf.generic.DictionaryObject()
+            back_xobjects = pypdf.generic.DictionaryObject()
+            front_side[pypdf.generic.NameObject('/Resources')] = pypdf.generic.DictionaryObject({pypdf.generic.NameObject('/XObject'): front_xobjects})
+            back_side[pypdf.generic.NameObject('/Resources')] = pypdf.generic.DictionaryObject({pypdf.generic.NameObject('/XObject'): back_xobjects})
+
+            front_drawing_commands = bytearray()
+            back_drawing_commands = bytearray()
 
             for (spread_x, spread_y, spread) in sheet.iter_spreads():
-                add_page(front_drawing_commands, front_side, spread.front_left, spread_size[0] * spread_x, spread_size[1] * spread_y)
-                add_page(front_drawing_commands, front_side, spread.front_right, spread_size[0] * (spread_x + 0.5), spread_size[1] * spread_y)
-                add_page(back_drawing_commands, back_side, spread.back_left, output_sheet_width - spread_size[0] * (spread_x + 1 - 0.5), spread_size[1] * spread_y)
-                add_page(back_drawing_commands, back_side, spread.back_right, output_sheet_width - spread_size[0] * (spread_x + 1), spread_size[1] * spread_y)
-
-            front_contents = front_side.get_contents()
-            assert front_contents is not None # TODO: not sure what to do if this happens
-            new_front_contents = front_contents.clone(output)
-            new_front_contents.set_data(new_front_contents.get_data() + ' '.join(front_drawing_commands).encode('ascii'))
-            front_side.replace_contents(new_front_contents)
-
-            back_contents = back_side.get_contents()
-            assert back_contents is not None # TODO: not sure what to do if this happens
-            new_back_contents = back_contents.clone(output)
-            new_back_contents.set_data(new_back_contents.get_data() + ' '.join(back_drawing_commands).encode('ascii'))
-            back_side.replace_contents(new_back_contents)
-
-    pages = pad_pages([OriginalPage(n) for n in range(input.get_num_pages())])
+                y = ys[spread_y]
+                add_page(front_drawing_commands, front_side, front_xobjects, spread.front_left, front_left_xs[spread_x], y)
+                add_page(front_drawing_commands, front_side, front_xobjects, spread.front_right, front_right_xs[spread_x], y)
+                add_page(back_drawing_commands, back_side, back_xobjects, spread.back_left, back_left_xs[spread_x], y)
+                add_page(back_drawing_commands, back_side, back_xobjects, spread.back_right, back_right_xs[spread_x], y)
+
+            # When cut lines aren't being marked, none of the bookkeeping for them is done at all
+            if mark_cut_lines:
+                front_page_positions: list[tuple[float, float]] = []
+                back_page_positions: list[tuple[float, float]] = []
+                for (spread_x, spread_y, _) in sheet.iter_spreads():
+                    y = ys[spread_y]
+                    front_page_positions += [(front_left_xs[spread_x], y), (front_right_xs[spread_x], y)]
+                    back_page_positions += [(back_left_xs[spread_x], y), (back_right_xs[spread_x], y)]
+
+                # The prelude comes after the pages so that the pages are drawn with the default graphics state
+                front_drawing_commands += cut_line_prelude
+                back_drawing_commands += cut_line_prelude
+
+                front_drawing_commands += cut_lines(front_page_positions)
+                back_drawing_commands += cut_lines(back_page_positions)
+
+            set_contents(front_side, front_drawing_commands)
+            set_contents(back_side, back_drawing_commands)
+
+    pages = pad_pages(array.array('i', range(len(input_pages))))
     spreads = make_spreads(pages)
     sheets = lay_out_spreads(spreads)
     write_sheets(sheets)
@@ -259,7 +389,8 @@ def main() -> None:
 
     impose(input_pdf, output_pdf, args.scale, args.last_pages, args.mark_cut_lines, args.mark_color, args.mark_width)
 
-    with open(args.output, 'wb') as f:
+    # pypdf writes the output one small object at a time, so a large buffer keeps that from turning into a huge number of tiny writes
+    with open(args.output, 'wb', buffering=1 << 20) as f:
         output_pdf.write(f)
 
     output_pdf.close()